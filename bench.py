@@ -0,0 +1,187 @@
+"""Micro-benchmarks for the condition scorer.
+
+Run from the repository root, e.g. ``python bench.py match``, ``python bench.py load``
+or ``python bench.py analyze``.
+"""
+from collections import Counter
+from difflib import SequenceMatcher
+import argparse
+import asyncio
+import random
+import os
+import statistics
+import time
+
+import main
+from main import MedicalConditionScorer
+
+DEFAULT_TERMS = [
+    "diabetes", "hypertension", "asthma", "HIV", "cardiomyopathy",
+    "heart failure", "chronic kidney disease",
+    "diabetis", "hypertensoin", "cardiomyopahty", "tuberculosos",
+]
+
+def _original_scan(scorer, term):
+    # The per-description loop /score used before the indexes existed, with a
+    # fresh SequenceMatcher for every word pair
+    search_lower = term.lower()
+    matches = []
+    for code, data in scorer.conditions.items():
+        desc_lower = data['description'].lower()
+        if search_lower in desc_lower:
+            score = 1.0
+        else:
+            score = 0.0
+            for search_word in search_lower.split():
+                for desc_word in desc_lower.split():
+                    ratio = SequenceMatcher(None, search_word, desc_word).ratio()
+                    if ratio > score:
+                        score = ratio
+        if score >= 0.75:
+            matches.append(score)
+    return matches
+
+def _cascade_scan(scorer, term):
+    # Same full scan through _fuzzy_match_score and its quick-ratio cascade
+    return [
+        score for score in (
+            scorer._fuzzy_match_score(term, data['description'])
+            for data in scorer.conditions.values()
+        )
+        if score >= 0.75
+    ]
+
+def _original_parse(csv_path):
+    # The line-by-line parser the scorer used before the csv module loader,
+    # building each field a character at a time
+    rows = []
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        for line_num, line in enumerate(file, 1):
+            if line_num == 1:
+                continue
+            parts = []
+            current = ""
+            in_quotes = False
+            for char in line.strip():
+                if char == '"':
+                    in_quotes = not in_quotes
+                elif char == ',' and not in_quotes:
+                    parts.append(current.strip())
+                    current = ""
+                else:
+                    current += char
+            parts.append(current.strip())
+            if len(parts) > 7 and parts[0] and parts[1]:
+                rows.append((parts[0], parts[1], parts[6]))
+    return rows
+
+def _time_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def bench_match(args):
+    # Without the match cache every repeat is a real lookup
+    scorer = MedicalConditionScorer(args.csv, match_cache_size=0)
+    neighbours = scorer._neighbour_indptr
+    print(f"{len(scorer.conditions)} conditions, {len(scorer._vocabulary)} distinct words, "
+          f"neighbour graph {'loaded' if neighbours is not None else 'missing'}")
+    print(f"{'term':<26}{'original':>12}{'cascade':>12}{'indexed':>12}{'no graph':>12}  (median ms)")
+
+    for term in args.terms:
+        original = _time_ms(lambda: _original_scan(scorer, term), args.scan_repeat)
+        cascade = _time_ms(lambda: _cascade_scan(scorer, term), args.scan_repeat)
+        scorer._neighbour_indptr = neighbours
+        indexed = _time_ms(lambda: scorer.find_condition_by_name([term]), args.repeat)
+        scorer._neighbour_indptr = None
+        unindexed = _time_ms(lambda: scorer.find_condition_by_name([term]), args.repeat)
+        scorer._neighbour_indptr = neighbours
+        print(f"{term:<26}{original:>12.2f}{cascade:>12.2f}{indexed:>12.3f}{unindexed:>12.3f}")
+
+def bench_load(args):
+    scorer = MedicalConditionScorer(args.csv, snapshot_path=args.snapshot)
+    rows = sum(1 for _ in scorer._iter_mapping_rows(args.csv))
+    print(f"{rows} mapping rows, {len(scorer.conditions)} conditions")
+    print(f"{'step':<26}{'median ms':>12}")
+
+    steps = [
+        ("parse (original)", lambda: _original_parse(args.csv)),
+        ("parse (csv module)", lambda: list(scorer._iter_mapping_rows(args.csv))),
+        ("build from CSV", lambda: MedicalConditionScorer(args.csv, snapshot_path=os.devnull)),
+        ("snapshot (memory)", lambda: MedicalConditionScorer(args.csv, snapshot_path=args.snapshot)),
+        ("snapshot (mmap)", lambda: MedicalConditionScorer(args.csv, snapshot_path=args.snapshot, storage="mmap")),
+    ]
+    for name, func in steps:
+        print(f"{name:<26}{_time_ms(func, args.repeat):>12.1f}")
+
+def bench_analyze(args):
+    # The whole /analyze request path, in-process, against the stub backend
+    import httpx
+    
+    main.llm_backend = main.StubBackend(args.latency_ms, args.latency_sigma, args.failure_rate, seed=args.seed)
+    main.analysis_cache = main.AnalysisCache(path=None)
+    main.analysis_gate = main.AdmissionGate(args.llm_concurrency, args.queue_size, args.queue_timeout)
+    rng = random.Random(args.seed)
+    bodies = [{"drug_name": f"Drug {rng.randrange(args.distinct)}"} for _ in range(args.requests)]
+    latencies = []
+    statuses = Counter()
+    
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            slots = asyncio.Semaphore(args.concurrency)
+            
+            async def post(body):
+                async with slots:
+                    start = time.perf_counter()
+                    response = await client.post("/analyze", json=body)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[response.status_code] += 1
+            
+            await asyncio.gather(*(post(body) for body in bodies))
+    
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{args.requests} requests, {args.distinct} distinct inputs, {args.concurrency} concurrent clients")
+    print(f"throughput {args.requests / elapsed:.1f} req/s, "
+          f"p50 {latencies[len(latencies) // 2]:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms")
+    print(f"status codes {dict(sorted(statuses.items()))}")
+    print(f"cache {main.analysis_cache.stats()}")
+    print(f"calls {main.analysis_flights.stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medical scorer benchmarks")
+    parser.add_argument("--csv", default="data/2025 Midyear_Final ICD-10-CM Mappings.csv")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    match_parser = subparsers.add_parser("match", help="per-term condition matching latency")
+    match_parser.add_argument("terms", nargs="*", default=DEFAULT_TERMS)
+    match_parser.add_argument("--repeat", type=int, default=50)
+    match_parser.add_argument("--scan-repeat", type=int, default=3)
+    match_parser.set_defaults(func=bench_match)
+
+    load_parser = subparsers.add_parser("load", help="mapping parse and scorer start-up time")
+    load_parser.add_argument("--snapshot", default="data/conditions.snapshot")
+    load_parser.add_argument("--repeat", type=int, default=5)
+    load_parser.set_defaults(func=bench_load)
+
+    analyze_parser = subparsers.add_parser("analyze", help="/analyze throughput and latency with the stub backend")
+    analyze_parser.add_argument("--requests", type=int, default=500)
+    analyze_parser.add_argument("--distinct", type=int, default=100, help="distinct inputs among the requests")
+    analyze_parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients")
+    analyze_parser.add_argument("--latency-ms", type=float, default=800, help="median stub latency")
+    analyze_parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal shape of the latency")
+    analyze_parser.add_argument("--failure-rate", type=float, default=0.0)
+    analyze_parser.add_argument("--llm-concurrency", type=int, default=8)
+    analyze_parser.add_argument("--queue-size", type=int, default=32)
+    analyze_parser.add_argument("--queue-timeout", type=float, default=10)
+    analyze_parser.add_argument("--seed", type=int, default=0)
+    analyze_parser.set_defaults(func=bench_analyze)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,19 +1,192 @@
-from typing import List, Dict, Optional
-from fastapi import FastAPI, HTTPException
+from typing import List, Dict, Optional, Tuple, Union
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field, ValidationError
 import uvicorn
+import numpy as np
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from collections.abc import Mapping, Sequence
 from difflib import SequenceMatcher
 import google.generativeai as genai
+import argparse
+import asyncio
+import csv
+import hashlib
 import os
 import json
+import math
+import mmap
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
 
 # Configure Gemini API
 api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
     genai.configure(api_key=api_key)
 
-app = FastAPI(title="Medical Condition Scoring API", version="1.0.0")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash")
+
+class LLMBackendError(Exception):
+    """The language model backend failed to produce an answer."""
+
+class LLMConfigError(LLMBackendError):
+    """The backend is not configured (e.g. no API key), so no call was made."""
+
+def _backend_error_status(error: LLMBackendError) -> int:
+    # Misconfiguration is this server's fault; anything else is the upstream's
+    return 500 if isinstance(error, LLMConfigError) else 502
+
+class LLMBackend(ABC):
+    """Text generation behind /analyze."""
+    
+    # Identifies the model in cache keys
+    name = ""
+    
+    @abstractmethod
+    async def generate(self, prompt: str, schema: Optional[type] = None) -> str:
+        """Answer the prompt, as JSON matching the Pydantic model `schema` if given."""
+    
+    async def stream(self, prompt: str, schema: Optional[type] = None):
+        """Yield the answer in pieces as it is generated."""
+        yield await self.generate(prompt, schema)
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        # One model per process. The client library creates its async gRPC
+        # client on the first call and reuses it, so requests share one
+        # long-lived HTTP/2 channel instead of connecting each time.
+        self.name = model_name
+        self._model = genai.GenerativeModel(model_name)
+    
+    async def generate(self, prompt: str, schema: Optional[type] = None) -> str:
+        if not os.getenv("GEMINI_API_KEY"):
+            raise LLMConfigError("GEMINI_API_KEY not configured")
+        try:
+            response = await self._model.generate_content_async(
+                prompt, generation_config=self._generation_config(schema)
+            )
+            return response.text
+        except Exception as e:
+            raise LLMBackendError(f"Gemini request failed: {e}") from e
+    
+    async def stream(self, prompt: str, schema: Optional[type] = None):
+        if not os.getenv("GEMINI_API_KEY"):
+            raise LLMConfigError("GEMINI_API_KEY not configured")
+        try:
+            response = await self._model.generate_content_async(
+                prompt, generation_config=self._generation_config(schema), stream=True
+            )
+            async for chunk in response:
+                yield chunk.text
+        except Exception as e:
+            raise LLMBackendError(f"Gemini request failed: {e}") from e
+    
+    @staticmethod
+    def _generation_config(schema: Optional[type]):
+        # Constrained decoding: Gemini emits plain JSON matching the schema
+        if schema is None:
+            return None
+        return genai.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+
+class StubBackend(LLMBackend):
+    """In-process stand-in for load tests that never leaves the machine.
+    
+    Answers with a fixed analysis, in the response schema's shape, after a log-normal delay (median latency_ms,
+    shape latency_sigma) and fails a failure_rate share of calls, drawing both
+    from a seeded generator so runs can be repeated.
+    """
+    
+    name = "stub"
+    
+    ANALYSIS = {
+        "medical_conditions": ["Type 2 diabetes mellitus"],
+        "refill_frequency": "Monthly",
+        "treatment_duration": "Long-term",
+        "is_chronic": True,
+        "consultation_needed": False,
+        "pricing_ksh": {
+            "medications": [{"name": "Metformin 500mg", "price_ksh": 450}],
+            "tests": [{"name": "HbA1c", "price_ksh": 2500}],
+            "consultation_cost": 2000,
+            "total_cost": 4950
+        }
+    }
+    
+    def __init__(self, latency_ms: float = 800, latency_sigma: float = 0.5, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+    
+    async def generate(self, prompt: str, schema: Optional[type] = None) -> str:
+        await asyncio.sleep(self._latency())
+        if self._random.random() < self.failure_rate:
+            raise LLMBackendError("Stub backend failure")
+        if schema is not None and "results" in schema.model_fields:
+            # Batch prompts number their items "Item 1:", "Item 2:", ...
+            items = len(re.findall(r"^Item \d+:$", prompt, re.MULTILINE))
+            return json.dumps({"results": [{**self.ANALYSIS, "item": item} for item in range(1, items + 1)]})
+        return json.dumps(self.ANALYSIS)
+    
+    async def stream(self, prompt: str, schema: Optional[type] = None, chunks: int = 8):
+        # The answer arrives in even pieces spread over the sampled latency
+        text = json.dumps(self.ANALYSIS)
+        size = -(-len(text) // chunks)
+        latency = self._latency()
+        fail = self._random.random() < self.failure_rate
+        for start in range(0, len(text), size):
+            await asyncio.sleep(latency / chunks)
+            if fail and start >= len(text) // 2:
+                raise LLMBackendError("Stub backend failure")
+            yield text[start:start + size]
+    
+    def _latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return self._random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+llm_backend = None
+
+def _get_llm_backend() -> LLMBackend:
+    # LLM_BACKEND picks the implementation: "gemini" (default) or "stub"
+    global llm_backend
+    if llm_backend is None:
+        if os.getenv("LLM_BACKEND", "gemini") == "stub":
+            seed = os.getenv("STUB_SEED")
+            llm_backend = StubBackend(
+                latency_ms=float(os.getenv("STUB_LATENCY_MS", "800")),
+                latency_sigma=float(os.getenv("STUB_LATENCY_SIGMA", "0.5")),
+                failure_rate=float(os.getenv("STUB_FAILURE_RATE", "0")),
+                seed=int(seed) if seed else None
+            )
+        else:
+            llm_backend = GeminiBackend(GEMINI_MODEL)
+    return llm_backend
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start every scoring worker before serving, so the first requests don't
+    # wait for processes to start and load the scorer
+    if _get_scoring_executor() is not None:
+        await asyncio.gather(*(_run_scoring(_ping_scoring_worker) for _ in range(SCORING_WORKERS)))
+    _get_llm_backend()
+    yield
+    if _scoring_executor is not None:
+        _scoring_executor.shutdown(cancel_futures=True)
+
+app = FastAPI(title="Medical Condition Scoring API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,70 +196,489 @@ app.add_middleware(
     allow_headers=["Content-Type"],
 )
 
+# Deletion depths for the typo index: how many characters are removed from each
+# vocabulary word when it is indexed, and from a search word when it is looked up
+_INDEX_DELETES = 2
+_QUERY_DELETES = 4
+
+# Header cells of the mapping CSV, with their line breaks folded to spaces
+_CODE_COLUMN = 'Diagnosis Code'
+_DESCRIPTION_COLUMN = 'Description'
+_HCC_V28_COLUMN = 'CMS-HCC Model Category V28'
+
+# RAF score of each CMS-HCC V28 category, and of any other or missing category
+_RAF_MAPPING = {
+    1: 0.80, 2: 0.65, 6: 0.45, 8: 0.25, 9: 0.35,
+    10: 0.40, 11: 0.30, 12: 0.28, 17: 0.60, 18: 0.55,
+    19: 0.38, 20: 0.42, 21: 0.32, 22: 0.30, 23: 0.70,
+    29: 0.45, 33: 0.35, 36: 0.40, 37: 0.38, 38: 0.35,
+    39: 0.32, 43: 0.35, 46: 0.48, 47: 0.42, 48: 0.38,
+    52: 0.45, 54: 0.38, 55: 0.35, 56: 0.38, 65: 0.40,
+    72: 0.38, 75: 0.35, 78: 0.32, 85: 0.42, 92: 0.32,
+    93: 0.30, 95: 0.38, 96: 0.35, 98: 0.35, 99: 0.38,
+    100: 0.32, 106: 0.35, 108: 0.38, 109: 0.42, 111: 0.35,
+    112: 0.38, 114: 0.45, 115: 0.40, 127: 0.38, 141: 0.35,
+    155: 0.35, 158: 0.32, 168: 0.28, 182: 0.35, 186: 0.38,
+    202: 0.45, 227: 0.40, 263: 0.35, 280: 0.38, 282: 0.42,
+    283: 0.35, 387: 0.28, 395: 0.38, 454: 0.45
+}
+_DEFAULT_RAF_SCORE = 0.1
+# Snapshots store RAF scores derived from this table, so they record its hash
+_RAF_MAPPING_SHA256 = hashlib.sha256(
+    json.dumps([sorted(_RAF_MAPPING.items()), _DEFAULT_RAF_SCORE]).encode('utf-8')
+).hexdigest()
+
+_SNAPSHOT_MAGIC = b'ICDSNAP\0'
+_SNAPSHOT_VERSION = 2
+
+def _file_sha256(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+def _csr(rows: List[List], dtype=np.int32) -> Tuple[np.ndarray, np.ndarray]:
+    # Row i of the result is values[indptr[i]:indptr[i + 1]]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    values = np.array([value for row in rows for value in row], dtype=dtype)
+    return indptr, values
+
+def _pack_strings(strings) -> Tuple[np.ndarray, np.ndarray]:
+    # Strings as one UTF-8 buffer plus the byte offset where each one starts
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def _write_snapshot(path: str, source_sha256: str, raf_sha256: str, arrays: Dict[str, np.ndarray]):
+    # Layout: magic, header length (8 bytes), JSON header, then the raw bytes of
+    # each array at an 8-byte aligned offset, so the file can be used in place
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        sections[name] = {'offset': offset, 'count': array.size, 'dtype': array.dtype.str}
+        offset = _align(offset + array.nbytes)
+    
+    header = json.dumps({
+        'version': _SNAPSHOT_VERSION,
+        'source_sha256': source_sha256,
+        'raf_sha256': raf_sha256,
+        'sections': sections
+    }).encode('utf-8')
+    
+    # Written next to the target and renamed, so running workers never see a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(_SNAPSHOT_MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        file.write(b'\0' * (_align(file.tell()) - file.tell()))
+        for array in arrays.values():
+            payload = np.ascontiguousarray(array).tobytes()
+            file.write(payload)
+            file.write(b'\0' * (_align(len(payload)) - len(payload)))
+    os.replace(temp_path, path)
+
+def _read_snapshot(path: str, use_mmap: bool = False):
+    # With use_mmap the arrays are read-only views on a shared mapping of the
+    # file; otherwise the file is read into this process first
+    with open(path, 'rb') as file:
+        if use_mmap:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = file.read()
+    if data[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a condition snapshot")
+    
+    start = len(_SNAPSHOT_MAGIC) + 8
+    header_length = int.from_bytes(data[len(_SNAPSHOT_MAGIC):start], 'little')
+    header = json.loads(data[start:start + header_length])
+    base = _align(start + header_length)
+    
+    sections = {
+        name: np.frombuffer(data, dtype=section['dtype'], count=section['count'], offset=base + section['offset'])
+        for name, section in header['sections'].items()
+    }
+    return header, sections
+
+def _length_window(length: int) -> range:
+    # A ratio 2m/(a+b) can only reach 0.75 when 2*min(a, b)/(a+b) does,
+    # i.e. for word lengths between 3a/5 and 5a/3
+    return range(-(-3 * length // 5), 5 * length // 3 + 1)
+
+def _deletes(word: str, depth: int) -> set:
+    # Every string obtained by removing at most `depth` characters from word
+    found = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        found |= frontier
+    return found
+
+class PackedStrings(Sequence):
+    """Read-only sequence of strings stored as one UTF-8 buffer plus offsets."""
+    
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._blob[self._offsets[index]:self._offsets[index + 1]].tobytes().decode('utf-8')
+
+class ConditionTable(Mapping):
+    """Read-only code -> {'description', 'raf_score'} view over packed columns.
+    
+    Stands in for the dict of dicts when the table comes from a snapshot, so no
+    per-condition objects exist until a code is looked up.
+    """
+    
+    def __init__(self, codes: PackedStrings, descriptions: PackedStrings,
+                 raf_scores: np.ndarray, code_order: np.ndarray):
+        self._codes = codes
+        self._descriptions = descriptions
+        self._raf_scores = raf_scores
+        self._code_order = code_order
+    
+    def _position(self, code: str) -> int:
+        # Binary search over the positions sorted by code
+        low, high = 0, len(self._code_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._codes[self._code_order[middle]] < code:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._code_order) and self._codes[self._code_order[low]] == code:
+            return int(self._code_order[low])
+        raise KeyError(code)
+    
+    def __getitem__(self, code):
+        position = self._position(code)
+        return {
+            'description': self._descriptions[position],
+            'raf_score': float(self._raf_scores[position])
+        }
+    
+    def __iter__(self):
+        return iter(self._codes)
+    
+    def __len__(self):
+        return len(self._codes)
+
 class MedicalConditionScorer:
-    def __init__(self, csv_path="data/2025 Midyear_Final ICD-10-CM Mappings.csv"):
+    def __init__(self, csv_path="data/2025 Midyear_Final ICD-10-CM Mappings.csv",
+                 snapshot_path="data/conditions.snapshot", match_cache_size=4096, storage="memory"):
+        # storage="mmap" maps the snapshot read-only instead of reading it, so
+        # every worker process shares one copy of the table and its indexes
+        self.csv_path = csv_path
+        self.snapshot_path = snapshot_path
+        self.match_cache_size = match_cache_size
+        self.storage = storage
         self.conditions = {}
+        self._source_sha256 = None
+        self._codes = []
+        self._descriptions = []
+        self._raf_scores = np.zeros(0, dtype=np.float64)
+        self._vocabulary = []
+        self._word_ids = {}
+        self._word_lengths = np.zeros(0, dtype=np.int32)
+        self._words_by_length = {}
+        self._posting_indptr = np.zeros(1, dtype=np.int32)
+        self._posting_positions = np.zeros(0, dtype=np.int32)
+        self._token_indptr = np.zeros(1, dtype=np.int32)
+        self._token_ids = np.zeros(0, dtype=np.int32)
+        self._deletion_keys = np.zeros(0, dtype=np.uint32)
+        self._deletion_indptr = np.zeros(1, dtype=np.int32)
+        self._deletion_word_ids = np.zeros(0, dtype=np.int32)
+        self._alphabet = {}
+        self._character_counts = np.zeros((0, 0), dtype=np.uint8)
+        self._neighbour_indptr = None
+        self._neighbour_ids = np.zeros(0, dtype=np.int32)
+        self._neighbour_ratios = np.zeros(0, dtype=np.float64)
+        self._matchers = {}
+        self._match_cache = OrderedDict()
+        # Guards the match cache and the shared matchers when scoring threads
+        # share one scorer
+        self._lock = threading.Lock()
         try:
             self._load_conditions(csv_path)
         except FileNotFoundError:
             pass
     
+    def reload(self):
+        """Re-read the mapping CSV, discarding cached matches."""
+        with self._lock:
+            self.conditions = {}
+            self._load_conditions(self.csv_path)
+    
     def _load_conditions(self, csv_path):
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            for line_num, line in enumerate(file, 1):
-                if line_num == 1:
+        # Cached matches describe the previous table
+        self._match_cache.clear()
+        self._matchers = {}
+        self._neighbour_indptr = None
+        self._source_sha256 = _file_sha256(csv_path)
+        if self._load_snapshot():
+            return
+        
+        for code, desc, hcc_v28 in self._iter_mapping_rows(csv_path):
+            self.conditions[code] = {
+                'description': desc,
+                'raf_score': self._get_raf_score(hcc_v28)
+            }
+        
+        self._build_token_index()
+        self._build_deletion_index()
+        self._build_character_counts()
+    
+    def _load_snapshot(self) -> bool:
+        # Only a snapshot built from this exact CSV and RAF table is used;
+        # anything else means parsing the CSV and building the indexes from scratch
+        try:
+            header, sections = _read_snapshot(self.snapshot_path, use_mmap=self.storage == "mmap")
+        except (FileNotFoundError, KeyError, ValueError):
+            return False
+        if (header['version'] != _SNAPSHOT_VERSION or header['source_sha256'] != self._source_sha256
+                or header.get('raf_sha256') != _RAF_MAPPING_SHA256):
+            return False
+        
+        self._codes = PackedStrings(sections['codes'], sections['code_offsets'])
+        self._descriptions = PackedStrings(sections['lower_descriptions'], sections['lower_description_offsets'])
+        if self.storage != "mmap":
+            # Substring checks read many descriptions per lookup; decode them once
+            self._descriptions = list(self._descriptions)
+        self._raf_scores = sections['raf_scores']
+        self.conditions = ConditionTable(
+            self._codes,
+            PackedStrings(sections['descriptions'], sections['description_offsets']),
+            self._raf_scores,
+            sections['code_order']
+        )
+        
+        self._set_vocabulary(list(PackedStrings(sections['vocabulary'], sections['vocabulary_offsets'])))
+        self._posting_indptr = sections['posting_indptr']
+        self._posting_positions = sections['posting_positions']
+        self._token_indptr = sections['token_indptr']
+        self._token_ids = sections['token_ids']
+        self._deletion_keys = sections['deletion_keys']
+        self._deletion_indptr = sections['deletion_indptr']
+        self._deletion_word_ids = sections['deletion_word_ids']
+        alphabet = sections['alphabet'].tobytes().decode('utf-8')
+        self._alphabet = {char: column for column, char in enumerate(alphabet)}
+        self._character_counts = sections['character_counts'].reshape(len(self._vocabulary), len(alphabet))
+        self._neighbour_indptr = sections['neighbour_indptr']
+        self._neighbour_ids = sections['neighbour_ids']
+        self._neighbour_ratios = sections['neighbour_ratios']
+        return True
+    
+    def save_snapshot(self):
+        """Build the neighbour graph and write every table and index to the snapshot."""
+        self.build_neighbours()
+        
+        codes = list(self._codes)
+        code_blob, code_offsets = _pack_strings(codes)
+        description_blob, description_offsets = _pack_strings(
+            self.conditions[code]['description'] for code in codes
+        )
+        lower_blob, lower_offsets = _pack_strings(self._descriptions)
+        vocabulary_blob, vocabulary_offsets = _pack_strings(self._vocabulary)
+        alphabet_blob, _ = _pack_strings([''.join(self._alphabet)])
+        
+        _write_snapshot(self.snapshot_path, self._source_sha256, _RAF_MAPPING_SHA256, {
+            'codes': code_blob,
+            'code_offsets': code_offsets,
+            'code_order': np.array(sorted(range(len(codes)), key=codes.__getitem__), dtype=np.int32),
+            'descriptions': description_blob,
+            'description_offsets': description_offsets,
+            'lower_descriptions': lower_blob,
+            'lower_description_offsets': lower_offsets,
+            'raf_scores': self._raf_scores,
+            'vocabulary': vocabulary_blob,
+            'vocabulary_offsets': vocabulary_offsets,
+            'posting_indptr': self._posting_indptr,
+            'posting_positions': self._posting_positions,
+            'token_indptr': self._token_indptr,
+            'token_ids': self._token_ids,
+            'deletion_keys': self._deletion_keys,
+            'deletion_indptr': self._deletion_indptr,
+            'deletion_word_ids': self._deletion_word_ids,
+            'alphabet': alphabet_blob,
+            'character_counts': self._character_counts,
+            'neighbour_indptr': self._neighbour_indptr,
+            'neighbour_ids': self._neighbour_ids,
+            'neighbour_ratios': self._neighbour_ratios,
+        })
+    
+    def _build_token_index(self):
+        # Map every lowercase description word to the (ascending) positions of the
+        # conditions using it, so lookups only visit descriptions sharing a word.
+        self._codes = list(self.conditions)
+        self._descriptions = [self.conditions[code]['description'].lower() for code in self._codes]
+        postings = {}
+        for position, description in enumerate(self._descriptions):
+            for word in dict.fromkeys(description.split()):
+                postings.setdefault(word, []).append(position)
+        
+        self._set_vocabulary(list(postings))
+        self._posting_indptr, self._posting_positions = _csr(list(postings.values()))
+        self._build_columns()
+    
+    def _set_vocabulary(self, vocabulary: List[str]):
+        self._vocabulary = vocabulary
+        self._word_ids = {word: word_id for word_id, word in enumerate(vocabulary)}
+        self._word_lengths = np.array([len(word) for word in vocabulary], dtype=np.int32)
+        self._words_by_length = {}
+        for word_id, word in enumerate(vocabulary):
+            self._words_by_length.setdefault(len(word), []).append(word_id)
+    
+    def _build_columns(self):
+        # Columnar copy of the table for vectorised scoring: description word ids
+        # in CSR layout (row i is token_ids[indptr[i]:indptr[i + 1]]) and the RAF
+        # scores by position. Rows without words point at a trailing id whose
+        # similarity is always zero, so every row is non-empty for reduceat.
+        empty_row = [len(self._vocabulary)]
+        self._token_indptr, self._token_ids = _csr([
+            sorted({self._word_ids[word] for word in description.split()}) or empty_row
+            for description in self._descriptions
+        ])
+        self._raf_scores = np.array(
+            [self.conditions[code]['raf_score'] for code in self._codes], dtype=np.float64
+        )
+    
+    def _iter_mapping_rows(self, csv_path):
+        """Yield (code, description, V28 category) for each row of the mapping CSV."""
+        # The file opens with banner rows, and its header cells contain quoted
+        # line breaks, so rows come from the csv module rather than from lines.
+        # Everything before the header row is banner; the header's cells, with
+        # their line breaks folded to spaces, locate the columns that are used.
+        with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+            rows = csv.reader(file)
+            for row in rows:
+                header = [' '.join(cell.split()) for cell in row]
+                if _CODE_COLUMN in header:
+                    break
+            else:
+                raise ValueError(f"{csv_path} has no '{_CODE_COLUMN}' header row")
+            
+            code_column = header.index(_CODE_COLUMN)
+            description_column = header.index(_DESCRIPTION_COLUMN)
+            hcc_column = header.index(_HCC_V28_COLUMN)
+            for row in rows:
+                if len(row) <= hcc_column:
                     continue
-                
-                parts = self._parse_csv_line(line.strip())
-                if len(parts) > 7 and parts[0] and parts[1]:
-                    code = parts[0].replace('"', '').strip()
-                    desc = parts[1].replace('"', '').strip()
-                    hcc_v28 = parts[6].strip() if len(parts) > 6 else ''
-                    
-                    self.conditions[code] = {
-                        'description': desc,
-                        'raf_score': self._get_raf_score(hcc_v28)
-                    }
-    
-    def _parse_csv_line(self, line):
-        parts = []
-        current = ""
-        in_quotes = False
-        
-        for char in line:
-            if char == '"':
-                in_quotes = not in_quotes
-            elif char == ',' and not in_quotes:
-                parts.append(current.strip())
-                current = ""
+                code = row[code_column].strip()
+                desc = row[description_column].strip()
+                if code and desc:
+                    yield code, desc, row[hcc_column].strip()
+    
+    def _build_deletion_index(self):
+        # Symmetric-deletion (SymSpell) index: each vocabulary word is filed under
+        # every string left after removing up to _INDEX_DELETES of its characters.
+        # The strings are kept as sorted CRC32 keys with the word ids in CSR
+        # layout; a colliding key only adds candidates that fail verification.
+        postings = {}
+        for word_id, word in enumerate(self._vocabulary):
+            for deleted in _deletes(word, _INDEX_DELETES):
+                postings.setdefault(zlib.crc32(deleted.encode('utf-8')), []).append(word_id)
+        
+        keys = sorted(postings)
+        self._deletion_keys = np.array(keys, dtype=np.uint32)
+        self._deletion_indptr, self._deletion_word_ids = _csr([postings[key] for key in keys])
+    
+    def _build_character_counts(self):
+        # Character multisets per vocabulary word, one column per character; the
+        # characters two words share bound the matches SequenceMatcher can find
+        alphabet = sorted({char for word in self._vocabulary for char in word})
+        self._alphabet = {char: column for column, char in enumerate(alphabet)}
+        self._character_counts = np.zeros((len(self._vocabulary), len(alphabet)), dtype=np.uint8)
+        for word_id, word in enumerate(self._vocabulary):
+            for char, count in Counter(word).items():
+                self._character_counts[word_id, self._alphabet[char]] = count
+    
+    def _matcher(self, word_id: int) -> SequenceMatcher:
+        # One matcher per vocabulary word, created on first use with the word
+        # analysed as the second sequence; lookups only swap in the search word.
+        # Only used under the scorer's lock, via _top_matches.
+        matcher = self._matchers.get(word_id)
+        if matcher is None:
+            matcher = self._matchers[word_id] = SequenceMatcher(None, '', self._vocabulary[word_id])
+        return matcher
+    
+    def _deletion_candidates(self, search_word: str) -> np.ndarray:
+        """Ids of the vocabulary words that may reach a 0.75 ratio against search_word."""
+        # A ratio of 2m/(a+b) >= 0.75 needs m >= 3(a+b)/8 matching characters, so
+        # deleting a-m characters from the search word and b-m from a description
+        # word of length b leaves a common string. Lengths where either side would
+        # need more deletions than the index covers are compared in full instead.
+        length = len(search_word)
+        query_depth = 0
+        indexed_lengths = []
+        scanned_lengths = []
+        for word_length in _length_window(length):
+            matches = -(-3 * (length + word_length) // 8)
+            if word_length - matches <= _INDEX_DELETES and length - matches <= _QUERY_DELETES:
+                indexed_lengths.append(word_length)
+                query_depth = max(query_depth, length - matches)
             else:
-                current += char
-        parts.append(current.strip())
-        return parts
+                scanned_lengths.append(word_length)
+        
+        hashes = np.array(
+            [zlib.crc32(deleted.encode('utf-8')) for deleted in _deletes(search_word, query_depth)],
+            dtype=np.uint32
+        )
+        slots = np.searchsorted(self._deletion_keys, hashes)
+        found = slots < len(self._deletion_keys)
+        found[found] = self._deletion_keys[slots[found]] == hashes[found]
+        
+        candidates = [np.zeros(0, dtype=np.int32)]
+        for slot in slots[found]:
+            candidates.append(self._deletion_word_ids[self._deletion_indptr[slot]:self._deletion_indptr[slot + 1]])
+        indexed = np.concatenate(candidates)
+        indexed = indexed[np.isin(self._word_lengths[indexed], indexed_lengths)]
+        
+        scanned = [word_id for word_length in scanned_lengths
+                   for word_id in self._words_by_length.get(word_length, ())]
+        return np.union1d(indexed, np.array(scanned, dtype=np.int32))
+    
+    def build_neighbours(self):
+        """Compute every vocabulary word's fuzzy neighbours (ratio >= 0.75)."""
+        neighbours = [[] for _ in self._vocabulary]
+        matcher = SequenceMatcher()
+        for word_id, word in enumerate(self._vocabulary):
+            # The description word is the matcher's second sequence, as in
+            # _fuzzy_match_score, so its analysis is reused for every search word
+            matcher.set_seq2(word)
+            for search_length in _length_window(len(word)):
+                for search_id in self._words_by_length.get(search_length, ()):
+                    matcher.set_seq1(self._vocabulary[search_id])
+                    if matcher.quick_ratio() >= 0.75:
+                        ratio = matcher.ratio()
+                        if ratio >= 0.75:
+                            neighbours[search_id].append((word_id, ratio))
+        
+        self._neighbour_indptr, self._neighbour_ids = _csr(
+            [[word_id for word_id, _ in row] for row in neighbours]
+        )
+        self._neighbour_ratios = np.array(
+            [ratio for row in neighbours for _, ratio in row], dtype=np.float64
+        )
     
     def _get_raf_score(self, hcc_value):
         if not hcc_value:
-            return 0.1
+            return _DEFAULT_RAF_SCORE
         try:
             hcc_num = int(hcc_value)
-            raf_mapping = {
-                1: 0.80, 2: 0.65, 6: 0.45, 8: 0.25, 9: 0.35,
-                10: 0.40, 11: 0.30, 12: 0.28, 17: 0.60, 18: 0.55,
-                19: 0.38, 20: 0.42, 21: 0.32, 22: 0.30, 23: 0.70,
-                29: 0.45, 33: 0.35, 36: 0.40, 37: 0.38, 38: 0.35,
-                39: 0.32, 43: 0.35, 46: 0.48, 47: 0.42, 48: 0.38,
-                52: 0.45, 54: 0.38, 55: 0.35, 56: 0.38, 65: 0.40,
-                72: 0.38, 75: 0.35, 78: 0.32, 85: 0.42, 92: 0.32,
-                93: 0.30, 95: 0.38, 96: 0.35, 98: 0.35, 99: 0.38,
-                100: 0.32, 106: 0.35, 108: 0.38, 109: 0.42, 111: 0.35,
-                112: 0.38, 114: 0.45, 115: 0.40, 127: 0.38, 141: 0.35,
-                155: 0.35, 158: 0.32, 168: 0.28, 182: 0.35, 186: 0.38,
-                202: 0.45, 227: 0.40, 263: 0.35, 280: 0.38, 282: 0.42,
-                283: 0.35, 387: 0.28, 395: 0.38, 454: 0.45
-            }
-            return raf_mapping.get(hcc_num, 0.1)
+            return _RAF_MAPPING.get(hcc_num, _DEFAULT_RAF_SCORE)
         except ValueError:
-            return 0.1
+            return _DEFAULT_RAF_SCORE
     
     def _fuzzy_match_score(self, search_term: str, description: str) -> float:
         search_lower = search_term.lower()
@@ -101,43 +693,151 @@ class MedicalConditionScorer:
         desc_words = desc_lower.split()
         
         max_score = 0.0
-        for search_word in search_words:
-            for desc_word in desc_words:
-                # Fuzzy match each word
-                ratio = SequenceMatcher(None, search_word, desc_word).ratio()
-                if ratio > max_score:
-                    max_score = ratio
+        matcher = SequenceMatcher()
+        for desc_word in desc_words:
+            matcher.set_seq2(desc_word)
+            for search_word in search_words:
+                matcher.set_seq1(search_word)
+                # Fuzzy match each word, trying the cheap upper bounds first
+                if matcher.real_quick_ratio() > max_score and matcher.quick_ratio() > max_score:
+                    ratio = matcher.ratio()
+                    if ratio > max_score:
+                        max_score = ratio
         
         return max_score
     
+    def _similar_words(self, search_word: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and ratios of the vocabulary words scoring >= 0.75 against search_word."""
+        # Known words are a lookup in the prebuilt neighbour graph
+        word_id = self._word_ids.get(search_word)
+        if word_id is not None and self._neighbour_indptr is not None:
+            start, end = self._neighbour_indptr[word_id], self._neighbour_indptr[word_id + 1]
+            return self._neighbour_ids[start:end], self._neighbour_ratios[start:end]
+        
+        # Unknown words, typically misspellings, only verify the typo candidates
+        # that share enough characters to reach 2m/(a+b) >= 0.75
+        candidates = self._deletion_candidates(search_word)
+        search_counts = np.zeros(len(self._alphabet), dtype=np.int32)
+        for char, count in Counter(search_word).items():
+            column = self._alphabet.get(char)
+            if column is not None:
+                search_counts[column] = count
+        shared = np.minimum(self._character_counts[candidates], search_counts).sum(axis=1)
+        candidates = candidates[8 * shared >= 3 * (len(search_word) + self._word_lengths[candidates])]
+        
+        word_ids = []
+        ratios = []
+        for word_id in candidates.tolist():
+            matcher = self._matcher(word_id)
+            matcher.set_seq1(search_word)
+            ratio = matcher.ratio()
+            if ratio >= 0.75:
+                word_ids.append(word_id)
+                ratios.append(ratio)
+        return np.array(word_ids, dtype=np.int32), np.array(ratios, dtype=np.float64)
+    
+    def _vocabulary_scores(self, search_words: List[str]) -> np.ndarray:
+        # Best ratio of each description word against any of the search words,
+        # left at zero for the words below the 0.75 threshold. The trailing
+        # slot is the id used by descriptions without words.
+        similarity = np.zeros(len(self._vocabulary) + 1, dtype=np.float64)
+        for search_word in search_words:
+            word_ids, ratios = self._similar_words(search_word)
+            similarity[word_ids] = np.maximum(similarity[word_ids], ratios)
+        return similarity
+    
+    def _match_scores(self, search_term: str) -> np.ndarray:
+        """Match score of every condition, indexed by table position."""
+        search_lower = search_term.lower()
+        search_words = search_lower.split()
+        
+        # Blank terms are substrings of every description
+        if not search_words:
+            return np.array([
+                self._fuzzy_match_score(search_term, description)
+                for description in self._descriptions
+            ], dtype=np.float64)
+        
+        # A description scores its best word ratio: gather the similarity of its
+        # words and take the maximum of each CSR row in one pass
+        similarity = self._vocabulary_scores(search_words)
+        scores = np.maximum.reduceat(similarity[self._token_ids], self._token_indptr[:-1])
+        
+        # A substring match keeps each search word inside a single description
+        # word, so only descriptions holding the longest one need checking.
+        longest_word = max(search_words, key=len)
+        for word_id, word in enumerate(self._vocabulary):
+            if longest_word in word:
+                start, end = self._posting_indptr[word_id], self._posting_indptr[word_id + 1]
+                for position in self._posting_positions[start:end]:
+                    if search_lower in self._descriptions[position]:
+                        scores[position] = 1.0
+        
+        return scores
+    
     def find_condition_by_name(self, condition_names: List[str]) -> List[Dict]:
         matched_conditions = []
         
         for condition_name in condition_names:
-            scored_matches = []
-            
-            for code, data in self.conditions.items():
-                match_score = self._fuzzy_match_score(condition_name, data['description'])
-                
-                # Accept matches with score >= 0.75 (75% similarity)
-                if match_score >= 0.75:
-                    scored_matches.append({
-                        'code': code,
-                        'raf_score': data['raf_score'],
-                        'match_score': match_score
-                    })
-            
-            # Sort by match quality and take top 5
-            scored_matches.sort(key=lambda x: x['match_score'], reverse=True)
-            
-            for match in scored_matches[:5]:
+            for code, raf_score, match_score in self._top_matches(condition_name):
                 matched_conditions.append({
-                    'raf_score': match['raf_score']
+                    'raf_score': raf_score
                 })
         
         return matched_conditions
     
+    def _top_matches(self, condition_name: str) -> Tuple[Tuple[str, float, float], ...]:
+        # Matching only depends on the lowercased term, so that is the cache key
+        key = condition_name.lower()
+        with self._lock:
+            matches = self._match_cache.get(key)
+            if matches is not None:
+                self._match_cache.move_to_end(key)
+                return matches
+            
+            match_scores = self._match_scores(condition_name)
+            
+            # Accept matches with score >= 0.75 (75% similarity)
+            positions = np.flatnonzero(match_scores >= 0.75)
+            
+            # Sort by match quality and take top 5; the stable sort keeps table
+            # order among ties, exactly as the original full scan did
+            top_positions = positions[np.argsort(-match_scores[positions], kind='stable')[:5]]
+            
+            matches = tuple(
+                (self._codes[position], float(self._raf_scores[position]), float(match_scores[position]))
+                for position in top_positions
+            )
+            self._match_cache[key] = matches
+            if len(self._match_cache) > self.match_cache_size:
+                self._match_cache.popitem(last=False)
+            return matches
+    
     def calculate_medical_score(self, condition_names: List[str], age: int) -> float:
+        conditions = self.find_condition_by_name(condition_names)
+        return self._combine_score(age, [condition['raf_score'] for condition in conditions])
+    
+    def calculate_batch_scores(self, records: List[Tuple[int, List[str]]]) -> List[float]:
+        """Score (age, condition names) records, matching each distinct term once."""
+        # Matching only depends on the lowercased term, and a record's score only
+        # on the highest RAF among its matches, so each term keeps just that
+        # (None when nothing matches it)
+        highest_rafs = {}
+        for _, condition_names in records:
+            for condition_name in condition_names:
+                key = condition_name.lower()
+                if key not in highest_rafs:
+                    highest_rafs[key] = max(
+                        (raf_score for _, raf_score, _ in self._top_matches(condition_name)), default=None
+                    )
+        
+        scores = []
+        for age, condition_names in records:
+            raf_scores = [highest_rafs[condition_name.lower()] for condition_name in condition_names]
+            scores.append(self._combine_score(age, [raf_score for raf_score in raf_scores if raf_score is not None]))
+        return scores
+    
+    def _combine_score(self, age: int, raf_scores: List[float]) -> float:
         if age < 30:
             age_score = 5
         elif age < 45: 
@@ -149,12 +849,10 @@ class MedicalConditionScorer:
         else:
             age_score = 20
         
-        conditions = self.find_condition_by_name(condition_names)
-        
-        if not conditions:
+        if not raf_scores:
             return round(age_score, 1)
         
-        highest_raf = max(condition['raf_score'] for condition in conditions)
+        highest_raf = max(raf_scores)
         condition_score = min(highest_raf * 100, 80)
         total_score = age_score + condition_score
         
@@ -162,14 +860,226 @@ class MedicalConditionScorer:
 
 scorer = None
 try:
-    scorer = MedicalConditionScorer()
+    scorer = MedicalConditionScorer(storage=os.getenv("CONDITION_STORAGE", "memory"))
 except:
     scorer = None
 
+def _init_scoring_worker(storage: str):
+    # Pool initializer. Forked workers inherit the parent's scorer and spawned
+    # ones load it when they import this module; either way it is in place
+    # before the first task, and a worker whose load failed retries here.
+    global scorer
+    if not scorer or not scorer.conditions:
+        scorer = MedicalConditionScorer(storage=storage)
+    if not scorer.conditions:
+        raise RuntimeError("No conditions loaded in scoring worker")
+
+def _score_conditions(condition_names: List[str], age: int) -> float:
+    return scorer.calculate_medical_score(condition_names, age)
+
+def _score_records(records: List[Tuple[int, List[str]]]) -> List[float]:
+    return scorer.calculate_batch_scores(records)
+
+def _ping_scoring_worker() -> int:
+    return len(scorer.conditions) if scorer else 0
+
+# Scoring is CPU-bound, so the API runs it in SCORING_WORKERS processes, each
+# with its own scorer, and the event loop only awaits the results. With 0 it
+# runs on the default thread pool in this process instead.
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "1"))
+_scoring_executor = None
+# Set when worker processes can't be started here (no sem_open, e.g. some
+# serverless runtimes); scoring then runs on threads as with SCORING_WORKERS=0
+_scoring_processes_unavailable = False
+# Set when the pool broke and could not be rebuilt; cleared by the next success
+_scoring_pool_broken = False
+
+def _get_scoring_executor() -> Optional[ProcessPoolExecutor]:
+    global _scoring_executor, _scoring_processes_unavailable
+    if _scoring_executor is None and SCORING_WORKERS > 0 and not _scoring_processes_unavailable:
+        try:
+            _scoring_executor = ProcessPoolExecutor(
+                SCORING_WORKERS,
+                initializer=_init_scoring_worker,
+                initargs=(os.getenv("CONDITION_STORAGE", "memory"),)
+            )
+        except (OSError, NotImplementedError):
+            _scoring_processes_unavailable = True
+    return _scoring_executor
+
+def _discard_scoring_executor(executor: ProcessPoolExecutor):
+    # Concurrent calls may all see the same broken pool; only the first one
+    # drops it, and the others pick up its replacement
+    global _scoring_executor
+    if _scoring_executor is executor:
+        _scoring_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def _run_scoring(func, *args):
+    # A worker that dies (OOM kill, crash) breaks the whole pool, so it is
+    # replaced and the call retried once; scoring has no side effects
+    global _scoring_pool_broken
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = _get_scoring_executor()
+        try:
+            result = await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            _discard_scoring_executor(executor)
+            if attempt:
+                _scoring_pool_broken = True
+                raise HTTPException(status_code=503, detail="Scoring workers unavailable")
+        else:
+            _scoring_pool_broken = False
+            return result
+
+_MEMBER_COLUMNS = ['id', 'age', 'conditions']
+
+def _member_row(row: dict) -> Tuple[str, int, List[str]]:
+    conditions = row['conditions'] or []
+    if isinstance(conditions, str):
+        conditions = conditions.split(';')
+    try:
+        age = int(row['age'])
+    except (TypeError, ValueError):
+        raise ValueError(f"age {row['age']!r} is not a whole number")
+    return row['id'], age, [name.strip() for name in conditions if name.strip()]
+
+def _read_member_file(path: str, skipped: List[str]):
+    """Yield (id, age, conditions) from a CSV or Parquet member file.
+    
+    Both need id, age and conditions columns. In CSV the conditions are one
+    field separated by semicolons; Parquet also accepts a list column. Rows
+    that cannot be scored are left out and described in skipped.
+    """
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet files needs pyarrow (pip install pyarrow)")
+        
+        parquet = pq.ParquetFile(path)
+        missing = [column for column in _MEMBER_COLUMNS if column not in parquet.schema_arrow.names]
+        if missing:
+            raise SystemExit(f"{path} has no {', '.join(missing)} column")
+        number = 0
+        for batch in parquet.iter_batches(columns=_MEMBER_COLUMNS):
+            for row in batch.to_pylist():
+                number += 1
+                try:
+                    yield _member_row(row)
+                except ValueError as e:
+                    skipped.append(f"row {number}: {e}")
+        return
+    
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.DictReader(file)
+        missing = [column for column in _MEMBER_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise SystemExit(f"{path} has no {', '.join(missing)} column")
+        for row in reader:
+            try:
+                yield _member_row(row)
+            except ValueError as e:
+                skipped.append(f"line {reader.line_num}: {e}")
+
+def _chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def score_file(input_path: str, output_path: str, workers: Optional[int] = None,
+               chunk_size: int = 500, storage: str = "memory") -> Tuple[int, List[str]]:
+    """Score a member file into an id,score CSV.
+    
+    Chunks of members are scored by a pool of worker processes, and each
+    chunk's results are written, in input order, as soon as it is done.
+    Returns the number of rows written and a description of each input row
+    that was skipped because it could not be scored.
+    """
+    if not scorer or not scorer.conditions:
+        raise RuntimeError("No conditions loaded, nothing to score")
+    workers = workers or os.cpu_count() or 1
+    rows = 0
+    skipped = []
+    # A worker whose initializer fails breaks the executor, so the job stops
+    # instead of respawning workers that can never score
+    with ProcessPoolExecutor(workers, initializer=_init_scoring_worker, initargs=(storage,)) as pool, \
+            open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['id', 'score'])
+        
+        # Pool.map would read the whole input ahead of the workers, so only a
+        # couple of chunks per worker are kept in flight; the ids stay here
+        pending = deque()
+        for chunk in _chunked(_read_member_file(input_path, skipped), chunk_size):
+            records = [(age, conditions) for _, age, conditions in chunk]
+            pending.append(([member_id for member_id, _, _ in chunk], pool.submit(_score_records, records)))
+            while pending and (len(pending) > 2 * workers or pending[0][1].done()):
+                ids, result = pending.popleft()
+                writer.writerows(zip(ids, result.result()))
+                rows += len(ids)
+        while pending:
+            ids, result = pending.popleft()
+            writer.writerows(zip(ids, result.result()))
+            rows += len(ids)
+    return rows, skipped
+
 class ScoringInput(BaseModel):
     age: int
     conditions: List[str]
 
+class PricedItem(BaseModel):
+    name: str
+    price_ksh: int
+
+class AnalysisPricing(BaseModel):
+    medications: List[PricedItem]
+    tests: List[PricedItem]
+    consultation_cost: int
+    total_cost: int
+    
+    def to_response(self) -> Dict:
+        # The API reports item prices as {name: price} objects; the schema
+        # uses lists because Gemini schemas cannot describe free-form keys
+        return {
+            "medications": {item.name: item.price_ksh for item in self.medications},
+            "tests": {item.name: item.price_ksh for item in self.tests},
+            "consultation_cost": self.consultation_cost,
+            "total_cost": self.total_cost
+        }
+
+class AnalysisResult(BaseModel):
+    """Analysis as Gemini is asked to produce it (its response schema)."""
+    
+    medical_conditions: List[str]
+    refill_frequency: str
+    treatment_duration: str
+    is_chronic: bool
+    consultation_needed: bool
+    pricing_ksh: AnalysisPricing
+    
+    def to_response(self) -> Dict:
+        return {**self.model_dump(exclude={"pricing_ksh"}), "pricing_ksh": self.pricing_ksh.to_response()}
+
+class BatchAnalysisItem(AnalysisResult):
+    item: int
+
+class BatchAnalysisResult(BaseModel):
+    """Response schema for several items analysed in one call."""
+    
+    results: List[BatchAnalysisItem]
+
+class BatchScoringRecord(BaseModel):
+    id: Union[str, int]
+    age: int
+    conditions: List[str]
+
 class AnalysisInput(BaseModel):
     drug_name: Optional[str] = None
     manufacturer: Optional[str] = None
@@ -177,70 +1087,467 @@ class AnalysisInput(BaseModel):
     tests: Optional[List[str]] = None
     additional_info: Optional[str] = None
 
+class BatchAnalysisInput(BaseModel):
+    items: List[AnalysisInput] = Field(min_length=1, max_length=100)
+
+class AnalysisCache:
+    """Two-tier cache of /analyze results: an in-memory LRU in front of SQLite.
+    
+    Entries expire ttl seconds after they are stored. The SQLite file keeps
+    results across restarts and is shared by the workers of one host.
+    """
+    
+    def __init__(self, path: Optional[str] = "data/analysis_cache.sqlite3", ttl: float = 86400,
+                 max_entries: int = 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+    
+    @staticmethod
+    def key(input_data: AnalysisInput, namespace: str = '') -> str:
+        """Hash of the input with case, spacing and test order normalised away.
+        
+        The namespace (the model name) keeps answers from different models apart.
+        """
+        def normalise(value):
+            return ' '.join(value.split()).lower() if value else ''
+        
+        fields = {
+            'drug_name': normalise(input_data.drug_name),
+            'manufacturer': normalise(input_data.manufacturer),
+            'quantity': normalise(input_data.quantity),
+            'tests': sorted(filter(None, map(normalise, input_data.tests or []))),
+            'additional_info': normalise(input_data.additional_info),
+            'namespace': namespace,
+        }
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT result, expires_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > now:
+                result = json.loads(row[0])
+                self._remember(key, row[1], result)
+                self.disk_hits += 1
+                return result
+            if row is not None:
+                self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+        
+        self.misses += 1
+        return None
+    
+    def put(self, key: str, result: Dict):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, result)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses (key, result, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(result), expires_at)
+            )
+    
+    def _remember(self, key: str, expires_at: float, result: Dict):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl,
+        }
+
+analysis_cache = None
+try:
+    analysis_cache = AnalysisCache(
+        path=os.getenv("ANALYZE_CACHE_PATH", "data/analysis_cache.sqlite3") or None,
+        ttl=float(os.getenv("ANALYZE_CACHE_TTL", "86400")),
+        max_entries=int(os.getenv("ANALYZE_CACHE_SIZE", "1024"))
+    )
+except sqlite3.Error:
+    # An unusable cache file only costs the disk tier
+    analysis_cache = AnalysisCache(path=None)
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers share its result."""
+    
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._tasks = {}
+    
+    async def run(self, key: str, call):
+        task = self._tasks.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._tasks[key] = asyncio.ensure_future(call())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # A caller that goes away must not cancel the call for the others
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: asyncio.Future):
+        del self._tasks[key]
+        # Mark the outcome as seen even if every caller has gone away
+        if not task.cancelled():
+            task.exception()
+    
+    def stats(self) -> Dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._tasks)}
+
+analysis_flights = SingleFlight()
+
+class AdmissionGate:
+    """Admits up to `concurrency` calls at once and queues a bounded number more.
+    
+    A call arriving to a full queue is rejected at once with 429, and one that
+    waits longer than queue_timeout seconds with 503; both carry Retry-After.
+    """
+    
+    def __init__(self, concurrency: int = 8, queue_size: int = 32, queue_timeout: float = 10,
+                 retry_after: int = 1):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = deque()
+    
+    @asynccontextmanager
+    async def admit(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+        else:
+            await self._wait()
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def check(self):
+        """Reject with 429 now if a new call would find the queue full."""
+        if (self.active >= self.concurrency or self._waiters) and len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many requests, try again later",
+                                headers={"Retry-After": str(self.retry_after)})
+    
+    async def _wait(self):
+        self.check()
+        
+        # A releasing call hands its slot straight to the first waiter
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived as this caller gave up, so pass it on
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise HTTPException(status_code=503, detail="Service busy, try again later",
+                                    headers={"Retry-After": str(self.retry_after)})
+            raise
+    
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+    
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+        }
+
+# Limits on concurrent Gemini calls per worker process
+analysis_gate = AdmissionGate(
+    concurrency=int(os.getenv("ANALYZE_CONCURRENCY", "8")),
+    queue_size=int(os.getenv("ANALYZE_QUEUE_SIZE", "32")),
+    queue_timeout=float(os.getenv("ANALYZE_QUEUE_TIMEOUT", "10")),
+    retry_after=int(os.getenv("ANALYZE_RETRY_AFTER", "1"))
+)
+
 @app.post("/analyze")
 async def analyze_medical_data(input_data: AnalysisInput):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
-    
-    # Build analysis prompt
-    prompt = """You are an expert medical AI assistant. Analyze the provided medical data using your medical knowledge and provide accurate predictions and analysis.
+    # Repeat inputs are answered from the cache without calling Gemini, and
+    # identical concurrent requests share one call
+    cache_key = AnalysisCache.key(input_data, _get_llm_backend().name)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return await analysis_flights.run(cache_key, lambda: _generate_analysis(input_data, cache_key))
+
+_ANALYSIS_ROLE = """You are an expert medical AI assistant. Analyze the provided medical data using your medical knowledge and provide accurate predictions and analysis.
 
 IMPORTANT: All responses must be based on your AI medical knowledge and predictions. Do not use placeholder data.
+"""
 
-Input Data:
+_ANALYSIS_FIELDS = """- medical_conditions: actual predicted conditions based on the drug/tests
+- refill_frequency: actual predicted frequency based on medical knowledge
+- treatment_duration: actual duration based on medical condition (if chronic: describe as long-term/lifelong, if not chronic: specify in months only)
+- is_chronic: whether the medical condition is chronic
+- consultation_needed: whether a doctor consultation is required
+- pricing_ksh.medications: one entry per drug provided, named with its dosage, with its price in Kenyan shillings
+- pricing_ksh.tests: one entry per test provided, with its price in Kenyan shillings
+- pricing_ksh.consultation_cost: actual consultation price in Kenyan shillings
+- pricing_ksh.total_cost: sum of all individual costs in Kenyan shillings
 """
-    
+
+_ANALYSIS_PRICING = """Provide real medical analysis with accurate Kenyan healthcare market pricing based on current Kenya medical costs (private hospitals, pharmacies, and labs in Nairobi/major cities). Use realistic whole Kenyan Shilling amounts, not generic responses."""
+
+def _describe_input(input_data: AnalysisInput) -> str:
+    description = ""
     if input_data.drug_name:
-        prompt += f"Drug Name: {input_data.drug_name}\n"
+        description += f"Drug Name: {input_data.drug_name}\n"
     if input_data.manufacturer:
-        prompt += f"Manufacturer: {input_data.manufacturer}\n"
+        description += f"Manufacturer: {input_data.manufacturer}\n"
     if input_data.quantity:
-        prompt += f"Quantity: {input_data.quantity}\n"
+        description += f"Quantity: {input_data.quantity}\n"
     if input_data.tests:
-        prompt += f"Tests: {', '.join(input_data.tests)}\n"
+        description += f"Tests: {', '.join(input_data.tests)}\n"
     if input_data.additional_info:
-        prompt += f"Additional Info: {input_data.additional_info}\n"
-    
-    prompt += """\n
-Analyze this medical data using your expert medical knowledge and provide accurate, evidence-based predictions in this exact JSON format:
-{
-  "medical_conditions": ["actual predicted conditions based on the drug/tests"],
-  "refill_frequency": "actual predicted frequency based on medical knowledge",
-  "treatment_duration": "actual duration based on medical condition (if chronic: describe as long-term/lifelong, if not chronic: specify in months only)",
-  "is_chronic": actual_boolean_based_on_medical_condition,
-  "consultation_needed": actual_boolean_if_doctor_consultation_required,
-  "pricing_ksh": {
-    "medications": {
-      "drug_name_with_dosage": price_in_ksh_for_each_drug_provided
-    },
-    "tests": {
-      "test_name": price_in_ksh_for_each_test_provided
-    },
-    "consultation_cost": actual_consultation_price_in_kenyan_shillings,
-    "total_cost": sum_of_all_individual_costs_in_kenyan_shillings
-  }
-}
+        description += f"Additional Info: {input_data.additional_info}\n"
+    return description
+
+def _analysis_prompt(input_data: AnalysisInput) -> str:
+    return (
+        _ANALYSIS_ROLE
+        + "\nInput Data:\n" + _describe_input(input_data)
+        + "\n\nAnalyze this medical data using your expert medical knowledge and provide accurate, "
+        + "evidence-based predictions as JSON with these fields:\n"
+        + _ANALYSIS_FIELDS + "\n" + _ANALYSIS_PRICING
+    )
 
-Provide real medical analysis with accurate Kenyan healthcare market pricing based on current Kenya medical costs (private hospitals, pharmacies, and labs in Nairobi/major cities). Use realistic Kenyan Shilling amounts, not generic responses. Return only valid JSON, no additional text."""
+def _batch_analysis_prompt(descriptions: List[str]) -> str:
+    # The shared instructions are sent once for all the items
+    items = "".join(f"Item {number}:\n{description}\n" for number, description in enumerate(descriptions, 1))
+    return (
+        _ANALYSIS_ROLE
+        + "\n" + items
+        + "\nAnalyze each item separately using your expert medical knowledge and provide accurate, "
+        + "evidence-based predictions as JSON: one entry in results per item, with item set to the item's "
+        + "number and these fields:\n"
+        + _ANALYSIS_FIELDS + "\n" + _ANALYSIS_PRICING
+    )
+
+async def _generate_analysis(input_data: AnalysisInput, cache_key: str) -> Dict:
+    prompt = _analysis_prompt(input_data)
+    async with analysis_gate.admit():
+        try:
+            response_text = await _get_llm_backend().generate(prompt, schema=AnalysisResult)
+        except LLMBackendError as e:
+            raise HTTPException(status_code=_backend_error_status(e), detail=str(e))
     
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
-    response = model.generate_content(prompt)
+    # The output is constrained to the schema, so one validating parse suffices
+    try:
+        result = AnalysisResult.model_validate_json(response_text).to_response()
+    except ValidationError as e:
+        raise HTTPException(status_code=502, detail=f"Model returned an invalid analysis: {e.error_count()} errors")
+    analysis_cache.put(cache_key, result)
+    return result
+
+# Items per batch analysis call, and the most input text packed into one prompt
+ANALYZE_BATCH_SIZE = int(os.getenv("ANALYZE_BATCH_SIZE", "5"))
+ANALYZE_BATCH_PROMPT_CHARS = int(os.getenv("ANALYZE_BATCH_PROMPT_CHARS", "6000"))
+
+@app.post("/analyze/batch")
+async def analyze_medical_data_batch(input_data: BatchAnalysisInput):
+    # Cached items are answered directly; the rest are deduplicated and packed
+    # into as few calls as the chunk limits allow, and each result goes back
+    # to every item it belongs to. Failures are reported per item.
+    backend_name = _get_llm_backend().name
+    keys = [AnalysisCache.key(item, backend_name) for item in input_data.items]
+    results = {}
+    pending = {}
+    for key, item in zip(keys, input_data.items):
+        if key not in results and key not in pending:
+            cached = analysis_cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending[key] = _describe_input(item)
     
-    # Clean the response text
-    response_text = response.text.strip()
+    chunks = []
+    for key, description in pending.items():
+        if not chunks or len(chunks[-1]) >= ANALYZE_BATCH_SIZE or \
+                sum(map(len, chunks[-1].values())) + len(description) > ANALYZE_BATCH_PROMPT_CHARS:
+            chunks.append({})
+        chunks[-1][key] = description
     
-    # Remove markdown code blocks if present
-    if response_text.startswith('```json'):
-        response_text = response_text[7:]
-    if response_text.startswith('```'):
-        response_text = response_text[3:]
-    if response_text.endswith('```'):
-        response_text = response_text[:-3]
+    for chunk_results in await asyncio.gather(*(_generate_batch_analysis(chunk) for chunk in chunks)):
+        results.update(chunk_results)
+    return {"results": [results[key] for key in keys]}
+
+async def _generate_batch_analysis(chunk: Dict[str, str]) -> Dict[str, Dict]:
+    """Analyse the described items in one call, returning results by cache key."""
+    keys = list(chunk)
+    try:
+        async with analysis_gate.admit():
+            try:
+                response_text = await _get_llm_backend().generate(
+                    _batch_analysis_prompt(list(chunk.values())), schema=BatchAnalysisResult
+                )
+            except LLMBackendError as e:
+                raise HTTPException(status_code=_backend_error_status(e), detail=str(e))
+        try:
+            answer = BatchAnalysisResult.model_validate_json(response_text)
+        except ValidationError as e:
+            raise HTTPException(status_code=502, detail=f"Model returned an invalid analysis: {e.error_count()} errors")
+    except HTTPException as e:
+        error = {"error": {"status": e.status_code, "detail": e.detail}}
+        return {key: error for key in keys}
     
-    response_text = response_text.strip()
+    results = {}
+    for item in answer.results:
+        if 1 <= item.item <= len(keys) and keys[item.item - 1] not in results:
+            result = AnalysisResult.model_validate(item.model_dump(exclude={"item"})).to_response()
+            analysis_cache.put(keys[item.item - 1], result)
+            results[keys[item.item - 1]] = result
+    for key in keys:
+        results.setdefault(key, {"error": {"status": 502, "detail": "Model returned no analysis for this item"}})
+    return results
+
+class JSONFieldStream:
+    """Incremental parser for a JSON object arriving in pieces.
     
-    return json.loads(response_text)
+    feed() returns the top-level members whose values completed in the text
+    given so far. Anything before the opening brace, such as a markdown
+    fence, is skipped.
+    """
+    
+    def __init__(self):
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member = []
+    
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        fields = []
+        for char in text:
+            if self.done:
+                break
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                continue
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    fields.extend(self._complete_member())
+                    continue
+            elif char == ',' and self._depth == 1:
+                fields.extend(self._complete_member())
+                continue
+            self._member.append(char)
+        return fields
+    
+    def _complete_member(self) -> List[Tuple[str, object]]:
+        member = ''.join(self._member).strip()
+        self._member = []
+        if not member:
+            return []
+        return list(json.loads('{' + member + '}').items())
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_medical_data_stream(input_data: AnalysisInput):
+    # Server-sent events: a "field" event for each top-level field of the
+    # analysis as soon as its value is complete, then "done", or "error" with
+    # the status the plain endpoint would have returned
+    cache_key = AnalysisCache.key(input_data, _get_llm_backend().name)
+    cached = analysis_cache.get(cache_key)
+    if cached is None:
+        analysis_gate.check()
+    
+    async def events():
+        if cached is not None:
+            for name, value in cached.items():
+                yield _sse("field", {"name": name, "value": value})
+            yield _sse("done", {})
+            return
+        
+        parser = JSONFieldStream()
+        fields = {}
+        try:
+            async with analysis_gate.admit():
+                async for text in _get_llm_backend().stream(_analysis_prompt(input_data), schema=AnalysisResult):
+                    for name, value in parser.feed(text):
+                        fields[name] = value
+                        if name == "pricing_ksh":
+                            value = AnalysisPricing.model_validate(value).to_response()
+                        yield _sse("field", {"name": name, "value": value})
+            if not parser.done:
+                raise ValueError("Incomplete analysis")
+            result = AnalysisResult.model_validate(fields).to_response()
+        except HTTPException as e:
+            yield _sse("error", {"status": e.status_code, "detail": e.detail})
+            return
+        except LLMBackendError as e:
+            yield _sse("error", {"status": _backend_error_status(e), "detail": str(e)})
+            return
+        except ValueError as e:
+            yield _sse("error", {"status": 502, "detail": str(e)})
+            return
+        
+        analysis_cache.put(cache_key, result)
+        yield _sse("done", {})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/debug-env")
 async def debug_environment():
@@ -269,19 +1576,140 @@ async def list_available_models():
     except Exception as e:
         return {"error": f"Failed to list models: {str(e)}", "api_key_status": "configured" if api_key else "missing"}
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "analysis_cache": analysis_cache.stats(),
+        "analysis_calls": analysis_flights.stats(),
+        "analysis_admission": analysis_gate.stats()
+    }
+
 @app.post("/score")
 async def score_medical_needs(input_data: ScoringInput):
     if not scorer or not scorer.conditions:
         raise HTTPException(status_code=503, detail="Service unavailable")
     
-    score = scorer.calculate_medical_score(input_data.conditions, input_data.age)
+    score = await _run_scoring(_score_conditions, input_data.conditions, input_data.age)
     return {"score": score}
 
+@app.post("/score/batch")
+async def score_medical_needs_batch(records: List[BatchScoringRecord]):
+    if not scorer or not scorer.conditions:
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    
+    scores = await _run_scoring(_score_records, [(record.age, record.conditions) for record in records])
+    return {"results": [{"id": record.id, "score": score} for record, score in zip(records, scores)]}
+
+# Longest NDJSON record accepted by /score/stream; longer lines get an error result
+_MAX_NDJSON_LINE = 64 * 1024
+
+async def _ndjson_lines(chunks, max_length: int = _MAX_NDJSON_LINE):
+    # Reassemble lines across body chunks. Only each new chunk is searched for
+    # line breaks, and a line growing past max_length is dropped as it arrives
+    # and yielded as None, so memory stays bounded by one chunk plus one line.
+    parts = []
+    length = 0
+    overlong = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            piece = chunk[start:] if end == -1 else chunk[start:end]
+            if not overlong:
+                length += len(piece)
+                if length > max_length:
+                    overlong = True
+                    parts = []
+                else:
+                    parts.append(piece)
+            if end == -1:
+                break
+            yield None if overlong else b''.join(parts)
+            parts = []
+            length = 0
+            overlong = False
+            start = end + 1
+    if overlong:
+        yield None
+    elif length:
+        yield b''.join(parts)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response whose body is produced while the request body is read.
+    
+    StreamingResponse listens for a disconnect by calling receive() next to the
+    body, which would swallow the request body messages. Here the body iterator
+    owns receive() and stops on a disconnect itself.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/score/stream")
+async def score_medical_needs_stream(request: Request):
+    if not scorer or not scorer.conditions:
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    
+    async def score_lines():
+        # One result line per record line, written as soon as the record is read;
+        # a bad line gets an error result instead of ending the stream
+        line_num = 0
+        try:
+            async for line in _ndjson_lines(request.stream()):
+                line_num += 1
+                if line is None:
+                    result = {"line": line_num, "error": f"line longer than {_MAX_NDJSON_LINE} bytes"}
+                elif not line.strip():
+                    continue
+                else:
+                    try:
+                        record = BatchScoringRecord.model_validate_json(line)
+                    except ValidationError as e:
+                        result = {"line": line_num, "error": [
+                            {"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()
+                        ]}
+                    else:
+                        result = {"id": record.id, "score": await _run_scoring(_score_conditions, record.conditions, record.age)}
+                yield json.dumps(result) + "\n"
+        except ClientDisconnect:
+            return
+    
+    return DuplexStreamingResponse(score_lines(), media_type="application/x-ndjson")
+
 @app.get("/health")
 async def health():
     if not scorer or not scorer.conditions:
         raise HTTPException(status_code=503, detail="Service unavailable")
+    if _scoring_pool_broken:
+        raise HTTPException(status_code=503, detail="Scoring workers unavailable")
     return {"status": "healthy", "conditions_loaded": len(scorer.conditions)}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Medical Condition Scoring API")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("build-index", help="write the binary snapshot of the mapping and its indexes")
+    score_parser = subparsers.add_parser("score-file", help="score a CSV or Parquet member file offline")
+    score_parser.add_argument("input", help="member file with id, age and conditions columns")
+    score_parser.add_argument("output", help="CSV file to write id,score rows to")
+    score_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    score_parser.add_argument("--chunk-size", type=int, default=500, help="members per worker task")
+    args = parser.parse_args()
+    
+    if args.command == "build-index":
+        if not scorer or not scorer.conditions:
+            raise SystemExit("No conditions loaded, nothing to index")
+        scorer.save_snapshot()
+        print(f"Wrote {len(scorer.conditions)} conditions and their indexes to {scorer.snapshot_path}")
+    elif args.command == "score-file":
+        if not scorer or not scorer.conditions:
+            raise SystemExit("No conditions loaded, nothing to score")
+        rows, skipped = score_file(args.input, args.output, workers=args.workers, chunk_size=args.chunk_size,
+                                   storage=os.getenv("CONDITION_STORAGE", "memory"))
+        for problem in skipped:
+            print(f"Skipped {args.input} {problem}", file=sys.stderr)
+        print(f"Scored {rows} members into {args.output}"
+              + (f", skipped {len(skipped)} invalid rows" if skipped else ""))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import main
+
+ANALYSIS = {
+    "medical_conditions": ["Type 2 diabetes"],
+    "refill_frequency": "Monthly",
+    "treatment_duration": "Long-term",
+    "is_chronic": True,
+    "consultation_needed": False,
+    "pricing_ksh": {
+        "medications": {"Metformin 500mg": 450},
+        "tests": {"HbA1c": 2500},
+        "consultation_cost": 2000,
+        "total_cost": 4950,
+    },
+}
+
+# The same analysis as Gemini returns it under the response schema
+MODEL_OUTPUT = {
+    **ANALYSIS,
+    "pricing_ksh": {
+        "medications": [{"name": "Metformin 500mg", "price_ksh": 450}],
+        "tests": [{"name": "HbA1c", "price_ksh": 2500}],
+        "consultation_cost": 2000,
+        "total_cost": 4950,
+    },
+}
+
+STUB_ANALYSIS = main.AnalysisResult.model_validate(main.StubBackend.ANALYSIS).to_response()
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel, answering after a fixed delay."""
+    
+    delay = 0.2
+    prompts = []
+    output = json.dumps(MODEL_OUTPUT)
+    
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+    
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        assert generation_config.response_mime_type == "application/json"
+        assert generation_config.response_schema is main.AnalysisResult
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.delay)
+        return _Response(self.output)
+
+@pytest.fixture(autouse=True)
+def fake_gemini(monkeypatch, tmp_path):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(main.genai, "GenerativeModel", FakeModel)
+    monkeypatch.setattr(main, "llm_backend", None)
+    monkeypatch.setattr(FakeModel, "prompts", [])
+    monkeypatch.setattr(main, "analysis_cache", main.AnalysisCache(path=str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(main, "analysis_gate", main.AdmissionGate())
+
+def _post_all(path, bodies):
+    async def post():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post(path, json=body) for body in bodies))
+    return asyncio.run(asyncio.wait_for(post(), timeout=30))
+
+def test_analyze_returns_parsed_analysis():
+    response, = _post_all("/analyze", [{"drug_name": "Metformin 500mg", "tests": ["HbA1c"]}])
+    
+    assert response.status_code == 200
+    assert response.json() == ANALYSIS
+    # Whole-shilling prices stay integers rather than turning into 450.0
+    pricing = response.json()["pricing_ksh"]
+    assert all(type(price) is int for price in [
+        *pricing["medications"].values(), *pricing["tests"].values(), pricing["consultation_cost"], pricing["total_cost"]
+    ])
+
+def test_concurrent_analyze_calls_overlap():
+    start = time.perf_counter()
+    responses = _post_all("/analyze", [{"drug_name": f"Drug {i}"} for i in range(10)])
+    
+    assert [response.status_code for response in responses] == [200] * 10
+    assert time.perf_counter() - start < 5 * FakeModel.delay
+
+def test_repeat_analyze_is_served_from_cache():
+    first, = _post_all("/analyze", [{"drug_name": "Metformin 500mg", "tests": ["HbA1c", "Lipid panel"]}])
+    second, = _post_all("/analyze", [{"drug_name": " metformin  500MG", "tests": ["lipid panel", "HbA1c"]}])
+    
+    assert second.json() == first.json()
+    assert len(FakeModel.prompts) == 1
+    assert main.analysis_cache.stats()["hits"] == 1
+
+def test_analysis_cache_persists_and_expires(tmp_path):
+    path = str(tmp_path / "persist.sqlite3")
+    key = main.AnalysisCache.key(main.AnalysisInput(drug_name="Metformin"), "models/test")
+    main.AnalysisCache(path=path).put(key, ANALYSIS)
+    
+    assert main.AnalysisCache(path=path).get(key) == ANALYSIS
+    
+    expired = main.AnalysisCache(path=path, ttl=-1)
+    expired.put(key, ANALYSIS)
+    assert expired.get(key) is None
+    assert main.AnalysisCache(path=path).get(key) is None
+
+def test_identical_concurrent_analyze_calls_share_one_request():
+    bodies = [{"drug_name": "Metformin 500mg"}, {"drug_name": "metformin 500mg"}, {"drug_name": "Amlodipine"}]
+    
+    responses = _post_all("/analyze", bodies * 3)
+    
+    assert [response.status_code for response in responses] == [200] * 9
+    assert len(FakeModel.prompts) == 2
+    assert main.analysis_flights.stats()["in_flight"] == 0
+
+def test_admission_queues_then_rejects_overflow(monkeypatch):
+    monkeypatch.setattr(main, "analysis_gate", main.AdmissionGate(concurrency=2, queue_size=2, queue_timeout=5))
+    
+    responses = _post_all("/analyze", [{"drug_name": f"Drug {i}"} for i in range(6)])
+    
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 200, 200, 429, 429]
+    assert all(response.headers["Retry-After"] == "1" for response in responses if response.status_code == 429)
+    assert main.analysis_gate.stats()["active"] == 0
+
+def test_admission_times_out_queued_calls(monkeypatch):
+    monkeypatch.setattr(main, "analysis_gate", main.AdmissionGate(concurrency=1, queue_size=4, queue_timeout=0.05))
+    
+    responses = _post_all("/analyze", [{"drug_name": f"Drug {i}"} for i in range(3)])
+    
+    assert sorted(response.status_code for response in responses) == [200, 503, 503]
+    stats = main.analysis_gate.stats()
+    assert (stats["timed_out"], stats["queue_depth"], stats["active"]) == (2, 0, 0)
+
+def test_analyze_reuses_one_model(monkeypatch):
+    models = []
+    monkeypatch.setattr(FakeModel, "__init__", lambda self, model_name, **kwargs: models.append(model_name))
+    
+    _post_all("/analyze", [{"drug_name": f"Drug {i}"} for i in range(3)])
+    
+    assert models == [main.GEMINI_MODEL]
+
+def test_stub_backend_answers_without_gemini(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY")
+    monkeypatch.setattr(main, "llm_backend", main.StubBackend(latency_ms=1, seed=1))
+    
+    response, = _post_all("/analyze", [{"drug_name": "Metformin 500mg"}])
+    
+    assert response.status_code == 200
+    assert response.json() == STUB_ANALYSIS
+    assert FakeModel.prompts == []
+
+def test_backend_failures_return_502(monkeypatch):
+    monkeypatch.setattr(main, "llm_backend", main.StubBackend(latency_ms=0, failure_rate=1.0))
+    
+    response, = _post_all("/analyze", [{"drug_name": "Metformin 500mg"}])
+    
+    assert response.status_code == 502
+    assert main.analysis_cache.stats()["entries"] == 0
+
+def test_missing_api_key_returns_500(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY")
+    
+    response, = _post_all("/analyze", [{"drug_name": "Metformin 500mg"}])
+    stream, = _post_all("/analyze/stream", [{"drug_name": "Metformin 500mg"}])
+    batch, = _post_all("/analyze/batch", [{"items": [{"drug_name": "Metformin 500mg"}]}])
+    
+    assert response.status_code == 500
+    assert _events(stream)[-1] == ("error", {"status": 500, "detail": "GEMINI_API_KEY not configured"})
+    assert batch.json()["results"][0]["error"]["status"] == 500
+    assert FakeModel.prompts == []
+
+def _events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def test_analyze_stream_emits_fields_as_they_complete(monkeypatch):
+    monkeypatch.setattr(main, "llm_backend", main.StubBackend(latency_ms=50, latency_sigma=0, seed=1))
+    
+    response, = _post_all("/analyze/stream", [{"drug_name": "Metformin 500mg"}])
+    
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response)
+    assert events[-1] == ("done", {})
+    assert [(event, data["name"]) for event, data in events[:-1]] == [
+        ("field", name) for name in STUB_ANALYSIS
+    ]
+    assert {data["name"]: data["value"] for _, data in events[:-1]} == STUB_ANALYSIS
+    
+    # The completed analysis is cached for both endpoints
+    again, = _post_all("/analyze", [{"drug_name": "metformin 500mg"}])
+    assert again.json() == STUB_ANALYSIS
+    assert main.analysis_cache.stats()["hits"] == 1
+
+def test_analyze_stream_reports_backend_failure(monkeypatch):
+    monkeypatch.setattr(main, "llm_backend", main.StubBackend(latency_ms=0, failure_rate=1.0))
+    
+    response, = _post_all("/analyze/stream", [{"drug_name": "Metformin 500mg"}])
+    
+    event, data = _events(response)[-1]
+    assert (event, data["status"]) == ("error", 502)
+    assert main.analysis_cache.stats()["entries"] == 0
+
+def test_invalid_model_output_returns_502(monkeypatch):
+    monkeypatch.setattr(FakeModel, "output", json.dumps({**MODEL_OUTPUT, "is_chronic": "sometimes"}))
+    
+    response, = _post_all("/analyze", [{"drug_name": "Metformin 500mg"}])
+    
+    assert response.status_code == 502
+    assert main.analysis_cache.stats()["entries"] == 0
+
+def test_batch_analyze_packs_items_into_chunked_calls(monkeypatch):
+    prompts = []
+    backend = main.StubBackend(latency_ms=0)
+    generate = backend.generate
+    
+    async def recording_generate(prompt, schema=None):
+        prompts.append(prompt)
+        return await generate(prompt, schema)
+    
+    monkeypatch.setattr(backend, "generate", recording_generate)
+    monkeypatch.setattr(main, "llm_backend", backend)
+    monkeypatch.setattr(main, "ANALYZE_BATCH_SIZE", 3)
+    items = [{"drug_name": f"Drug {i}"} for i in range(7)] + [{"drug_name": "drug 0"}]
+    
+    response, = _post_all("/analyze/batch", [{"items": items}])
+    
+    assert response.status_code == 200
+    assert response.json()["results"] == [STUB_ANALYSIS] * 8
+    assert [prompt.count("Drug Name:") for prompt in prompts] == [3, 3, 1]
+    assert main.analysis_cache.stats()["entries"] == 7
+
+def test_batch_analyze_reports_failures_per_item(monkeypatch):
+    monkeypatch.setattr(main, "llm_backend", main.StubBackend(latency_ms=0))
+    main.analysis_cache.put(main.AnalysisCache.key(main.AnalysisInput(drug_name="Cached"), "stub"), ANALYSIS)
+    monkeypatch.setattr(main.llm_backend, "failure_rate", 1.0)
+    
+    response, = _post_all("/analyze/batch", [{"items": [{"drug_name": "Cached"}, {"drug_name": "Fresh"}]}])
+    
+    cached, failed = response.json()["results"]
+    assert cached == ANALYSIS
+    assert failed["error"]["status"] == 502
@@ -0,0 +1,52 @@
+from difflib import SequenceMatcher
+
+import pytest
+
+import main
+
+TERMS = [
+    "diabetes", "Hypertension", "HIV", "heart failure", "chronic kidney disease",
+    "diabetis", "hypertensoin", "cardiomyopahty", "tuberculosos", "kjnee", "pnuemonia",
+    "paraneoplastic", "immunodeficiency", "encephalomyelitis", "osteoarthritis of knee",
+    "xyzzyqwertyuiopasdfghjk", "d", " ",
+]
+
+@pytest.fixture(scope="module")
+def scorer():
+    scorer = main.MedicalConditionScorer(match_cache_size=0)
+    if scorer._neighbour_indptr is None:
+        scorer.build_neighbours()
+    return scorer
+
+def _reference_matches(scorer, term):
+    # The original full scan: every description scores 1.0 for a substring match,
+    # otherwise its best word-pair SequenceMatcher ratio
+    search_lower = term.lower()
+    ratios = {}
+    matches = []
+    for code, data in scorer.conditions.items():
+        desc_lower = data['description'].lower()
+        if search_lower in desc_lower:
+            score = 1.0
+        else:
+            score = 0.0
+            for search_word in search_lower.split():
+                for desc_word in desc_lower.split():
+                    if (search_word, desc_word) not in ratios:
+                        ratios[search_word, desc_word] = SequenceMatcher(None, search_word, desc_word).ratio()
+                    score = max(score, ratios[search_word, desc_word])
+        if score >= 0.75:
+            matches.append((code, data['raf_score'], score))
+    matches.sort(key=lambda match: match[2], reverse=True)
+    return tuple(matches[:5])
+
+@pytest.mark.parametrize("graph", [True, False], ids=["neighbour graph", "no graph"])
+def test_top_matches_equal_full_scan(scorer, graph):
+    neighbours = scorer._neighbour_indptr
+    if not graph:
+        scorer._neighbour_indptr = None
+    try:
+        for term in TERMS:
+            assert scorer._top_matches(term) == _reference_matches(scorer, term), term
+    finally:
+        scorer._neighbour_indptr = neighbours
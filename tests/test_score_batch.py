@@ -0,0 +1,14 @@
+import main
+
+
+def test_batch_scores_match_single_scores():
+    records = [
+        (45, ["diabetes", "Diabetes", "cancer"]),
+        (70, ["diabetis", "hypertension"]),
+        (20, []),
+        (80, ["xyzzy"]),
+    ]
+    
+    assert main.scorer.calculate_batch_scores(records) == [
+        main.scorer.calculate_medical_score(conditions, age) for age, conditions in records
+    ]
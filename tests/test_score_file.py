@@ -0,0 +1,63 @@
+import csv
+
+import pytest
+
+import main
+
+
+def test_score_file_writes_scores_in_input_order(tmp_path):
+    members = [
+        ("M001", 45, "diabetes;cancer"),
+        ("M002", 70, "hypertensoin"),
+        ("M003", 20, ""),
+        ("M004", 80, "diabetes"),
+    ]
+    input_path = tmp_path / "members.csv"
+    with open(input_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "age", "conditions"])
+        writer.writerows(members)
+    output_path = tmp_path / "scores.csv"
+    
+    rows, skipped = main.score_file(str(input_path), str(output_path), workers=2, chunk_size=1)
+    
+    with open(output_path, newline="") as file:
+        results = list(csv.DictReader(file))
+    assert rows == len(members)
+    assert skipped == []
+    assert [result["id"] for result in results] == [member_id for member_id, _, _ in members]
+    assert [float(result["score"]) for result in results] == [
+        main.scorer.calculate_medical_score([name for name in conditions.split(";") if name], age)
+        for _, age, conditions in members
+    ]
+
+
+def test_score_file_refuses_to_run_without_conditions(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "scorer", main.MedicalConditionScorer(csv_path=str(tmp_path / "missing.csv")))
+    input_path = tmp_path / "members.csv"
+    input_path.write_text("id,age,conditions\nM001,45,diabetes\n")
+    
+    with pytest.raises(RuntimeError):
+        main.score_file(str(input_path), str(tmp_path / "scores.csv"), workers=1)
+
+
+def test_score_file_skips_rows_it_cannot_score(tmp_path):
+    input_path = tmp_path / "members.csv"
+    input_path.write_text("id,age,conditions\nM001,45,diabetes\nM002,unknown,asthma\nM003\nM004,70,\n")
+    output_path = tmp_path / "scores.csv"
+    
+    rows, skipped = main.score_file(str(input_path), str(output_path), workers=1, chunk_size=1)
+    
+    with open(output_path, newline="") as file:
+        results = list(csv.DictReader(file))
+    assert rows == 2
+    assert [result["id"] for result in results] == ["M001", "M004"]
+    assert skipped == ["line 3: age 'unknown' is not a whole number", "line 4: age None is not a whole number"]
+
+
+def test_score_file_names_missing_columns(tmp_path):
+    input_path = tmp_path / "members.csv"
+    input_path.write_text("id,age\nM001,45\n")
+    
+    with pytest.raises(SystemExit, match="no conditions column"):
+        main.score_file(str(input_path), str(tmp_path / "scores.csv"), workers=1)
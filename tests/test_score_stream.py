@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import httpx
+
+import main
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+def _post_stream(*chunks):
+    async def post():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/score/stream", content=_chunks(*chunks))
+    return asyncio.run(asyncio.wait_for(post(), timeout=30))
+
+def _lines(*chunks):
+    async def collect():
+        return [line async for line in main._ndjson_lines(_chunks(*chunks), max_length=8)]
+    return asyncio.run(collect())
+
+def test_stream_returns_one_line_per_record():
+    records = [
+        {"id": "M001", "age": 45, "conditions": ["diabetes"]},
+        {"id": "M002", "age": 70, "conditions": ["hypertension", "asthma"]},
+        {"id": 3, "age": 20, "conditions": []},
+    ]
+    body = "\n".join(json.dumps(record) for record in records).encode()
+    
+    # Records split across chunks mid-line must still be scored whole
+    response = _post_stream(body[:30], body[30:75], body[75:])
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["id"] for result in results] == ["M001", "M002", 3]
+    assert [result["score"] for result in results] == [
+        main.scorer.calculate_medical_score(record["conditions"], record["age"]) for record in records
+    ]
+
+def test_stream_reports_bad_lines_and_continues():
+    body = b'not json\n\n{"id": "M001", "age": "x", "conditions": []}\n{"id": "M002", "age": 45, "conditions": []}\n'
+    
+    results = [json.loads(line) for line in _post_stream(body).text.splitlines()]
+    
+    assert [result.get("line") for result in results] == [1, 3, None]
+    assert results[2] == {"id": "M002", "score": 15}
+
+def test_ndjson_lines_reassembles_chunks_and_drops_overlong_lines():
+    assert _lines(b"ab", b"c\nde", b"f\n", b"g") == [b"abc", b"def", b"g"]
+    assert _lines(b"0123", b"45678", b"9\nok\n", b"toolong!!") == [None, b"ok", None]
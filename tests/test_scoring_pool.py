@@ -0,0 +1,73 @@
+import asyncio
+import os
+import signal
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def scoring_pool(monkeypatch):
+    monkeypatch.setattr(main, "SCORING_WORKERS", 1)
+    monkeypatch.setattr(main, "_scoring_executor", None)
+    monkeypatch.setattr(main, "_scoring_processes_unavailable", False)
+    monkeypatch.setattr(main, "_scoring_pool_broken", False)
+    yield
+    if main._scoring_executor is not None:
+        main._scoring_executor.shutdown(cancel_futures=True)
+
+def _run(*requests):
+    # Every request runs on one event loop, as it would in the server
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = []
+            for request in requests:
+                if callable(request):
+                    responses.append(await request())
+                else:
+                    method, path, body = request
+                    responses.append(await client.request(method, path, json=body))
+            return responses
+    return asyncio.run(asyncio.wait_for(send(), timeout=60))
+
+SCORE = ("POST", "/score", {"age": 45, "conditions": ["diabetes"]})
+HEALTH = ("GET", "/health", None)
+
+async def _kill_worker():
+    os.kill(await main._run_scoring(os.getpid), signal.SIGKILL)
+
+async def _crash_every_worker():
+    try:
+        await main._run_scoring(os._exit, 1)
+    except main.HTTPException as e:
+        return e.status_code
+
+def test_score_recovers_after_a_worker_dies():
+    expected = main.scorer.calculate_medical_score(["diabetes"], 45)
+    
+    first, _, second, health = _run(SCORE, _kill_worker, SCORE, HEALTH)
+    
+    assert first.json() == second.json() == {"score": expected}
+    assert health.status_code == 200
+
+def test_health_reports_a_pool_that_could_not_be_rebuilt():
+    status, health, score, recovered = _run(_crash_every_worker, HEALTH, SCORE, HEALTH)
+    
+    assert status == 503
+    assert health.status_code == 503
+    assert score.status_code == 200
+    assert recovered.status_code == 200
+
+def test_scoring_falls_back_to_threads_without_process_support(monkeypatch):
+    def unsupported(*args, **kwargs):
+        raise NotImplementedError("sem_open is not available")
+    monkeypatch.setattr(main, "ProcessPoolExecutor", unsupported)
+    
+    score, = _run(SCORE)
+    
+    assert score.json() == {"score": main.scorer.calculate_medical_score(["diabetes"], 45)}
+    assert main._scoring_executor is None
+    assert main._scoring_processes_unavailable
@@ -0,0 +1,32 @@
+import main
+
+MAPPING = (
+    "Diagnosis Code,Description,CMS-HCC Model Category V28\n"
+    "E119,Type 2 diabetes mellitus without complications,38\n"
+    "I10,Essential (primary) hypertension,\n"
+    "C50911,Malignant neoplasm of unspecified site of right female breast,23\n"
+)
+
+def _scorer(tmp_path):
+    csv_path = tmp_path / "mapping.csv"
+    if not csv_path.exists():
+        csv_path.write_text(MAPPING)
+    return main.MedicalConditionScorer(csv_path=str(csv_path), snapshot_path=str(tmp_path / "conditions.snapshot"))
+
+def test_snapshot_is_loaded_when_its_inputs_are_unchanged(tmp_path):
+    _scorer(tmp_path).save_snapshot()
+    
+    scorer = _scorer(tmp_path)
+    
+    assert scorer._neighbour_indptr is not None
+    assert scorer.conditions['C50911']['raf_score'] == 0.70
+
+def test_snapshot_is_ignored_when_the_raf_mapping_changes(tmp_path, monkeypatch):
+    _scorer(tmp_path).save_snapshot()
+    monkeypatch.setitem(main._RAF_MAPPING, 23, 0.75)
+    monkeypatch.setattr(main, "_RAF_MAPPING_SHA256", "changed")
+    
+    scorer = _scorer(tmp_path)
+    
+    assert scorer._neighbour_indptr is None
+    assert scorer.conditions['C50911']['raf_score'] == 0.75